@@ -0,0 +1,8 @@
+# Loaded automatically by gunicorn from the working directory (see Procfile)
+
+
+def post_worker_init(worker):
+    # Per worker, after the app is imported: threads started before the
+    # fork would not survive it
+    from groq_robot import start_phrase_bank
+    start_phrase_bank()
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep groq_robot away from the real audio cache
+os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="aarav-test-cache-")
+os.environ.pop("ESP32_ALLOWED_NETWORKS", None)